@@ -1,14 +1,35 @@
 """Top level driver script for unredacting PDF files."""
 
-import sys
+import argparse
 
 from unredact.__main__ import get_output_filename, main
+from unredact.utils.constants import DEFAULT_COMPRESSION_LEVEL
 
-if len(sys.argv) != 2:
-    sys.stderr.write(f"usage: {sys.argv[0]} <pdf_file>\n")
-    sys.exit(1)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Remove weak redactions from a PDF file."
+    )
+    parser.add_argument("pdf_file", help="path of the redacted PDF file")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="print progress messages"
+    )
+    parser.add_argument(
+        "-c",
+        "--compression",
+        type=int,
+        choices=range(10),
+        default=DEFAULT_COMPRESSION_LEVEL,
+        metavar="LEVEL",
+        help="zlib level for page content, 0 (none, fastest) to 9 (smallest); "
+        f"default {DEFAULT_COMPRESSION_LEVEL}",
+    )
+    args = parser.parse_args()
 
-pdf_file = sys.argv[1]
-output_pdf = get_output_filename(pdf_file)
+    output_pdf = get_output_filename(args.pdf_file)
 
-main(pdf_file, output_pdf)
+    main(
+        args.pdf_file,
+        output_pdf,
+        verbose=args.verbose,
+        compression=args.compression,
+    )
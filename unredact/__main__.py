@@ -3,8 +3,14 @@ import pathlib
 import re
 import struct
 import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from io import BytesIO
+from multiprocessing import Pool, cpu_count
+from typing import Any, BinaryIO, Dict, List
 
+import numpy as np
 import PIL
 from pdfminer.converter import PDFPageAggregator
 from pdfminer.layout import (
@@ -27,10 +33,74 @@ from pdfminer.pdfcolor import (
 from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdftypes import LITERALS_DCT_DECODE
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib.rl_accel import fp_str
 from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfdoc, pdfmetrics
 from reportlab.pdfgen import canvas
 
-from unredact.utils.constants import DEFAULT_FONT, FONTS
+from unredact.utils.constants import (
+    DEFAULT_COMPRESSION_LEVEL,
+    DEFAULT_FONT,
+    FONTS,
+)
+
+# Subset fonts embedded in a PDF have names prefixed with six capital
+# letters and a plus sign, e.g. "ABCDEF+ArialMT".
+_FONT_PREFIX_RE = re.compile(r"^[A-Z]{6}\+")
+
+# Fonts ReportLab can always draw with, without registering them first.
+_STANDARD_FONTS = frozenset(pdfmetrics.standardFonts)
+
+# Maps font names found in the PDF to the font used to draw them.
+_font_cache: Dict[str, str] = {}
+
+# pdfminer gives gray levels as a single number and other colors as a
+# tuple or list of components.
+_COLOR_COMPONENT_TYPES = frozenset((tuple, list))
+
+# Layout analysis settings. boxes_flow=None skips ordering text boxes by
+# reading flow, which can be very slow on some documents. Pages are rebuilt
+# by position, so the order text boxes are drawn in doesn't matter.
+_LA_PARAMS = LAParams(
+    line_overlap=0.5,
+    char_margin=2.0,
+    line_margin=0.5,
+    word_margin=0.1,
+    boxes_flow=None,
+    detect_vertical=False,
+    all_texts=False,
+)
+
+# The font and colors last set on the page being drawn. PDF graphics state
+# starts over with each page, so reset_canvas_state() is called whenever a
+# new page is started.
+_canvas_state: Dict[str, Any] = {"font": None, "stroke": None, "fill": None}
+
+
+class _LeveledZCompress:
+    """
+    ReportLab stream filter that compresses with a chosen zlib level.
+
+    ReportLab's own filter always uses zlib's default level. While
+    pdfdoc.PDFZCompress is replaced with an instance of this class, the
+    streams ReportLab writes are compressed at the chosen level.
+    """
+
+    pdfname = "FlateDecode"
+
+    def __init__(self, level):
+        self.level = level
+
+    def encode(self, text):
+        """Compress a stream's content."""
+        if isinstance(text, str):
+            text = text.encode("utf8")
+        return zlib.compress(text, self.level)
+
+    def decode(self, encoded):
+        """Decompress a stream's content."""
+        return zlib.decompress(encoded)
 
 
 def get_output_filename(input_filepath):
@@ -41,46 +111,72 @@ def get_output_filename(input_filepath):
     )
 
 
-def print_char(canvas, char_element):
+def print_char(canvas: canvas.Canvas, char_element: LTChar) -> None:
     """
     Add a single character to the canvas.
 
     Adds the character in char_element using formatting from the original
     PDF document.
     """
-    attrs = char_element.__dict__
-    fontname = attrs["fontname"]
-    fontname = re.sub(r"^[A-Z]{6}\+", "", fontname)
-    if fontname in FONTS:
-        fontname = FONTS[fontname]
-    try:
-        canvas.setFont(fontname, attrs["size"])
-    except KeyError as err:
-        print("unknown font:", err, "falling back to", DEFAULT_FONT)
-        print(
-            "But you can add this font to the FONTS in the constants file to "
-            "improve the output."
-        )
-        canvas.setFont(DEFAULT_FONT, attrs["size"])
+    graphicstate = char_element.graphicstate
+    set_canvas_font(canvas, char_element.fontname, char_element.size)
+    set_canvas_colors(canvas, graphicstate.scolor, graphicstate.ncolor)
+    canvas.drawString(char_element.x0, char_element.y0, text=char_element._text)
 
+
+def print_char_run(canvas: canvas.Canvas, char_elements: List[LTChar]) -> None:
+    """
+    Add a run of characters sharing font, colors and baseline to the canvas.
+
+    The run is drawn as a single text object with each character placed
+    relative to the one before it.
+    """
+    first = char_elements[0]
+    set_canvas_font(canvas, first.fontname, first.size)
     set_canvas_colors(
         canvas,
-        char_element.graphicstate.scolor,
-        char_element.graphicstate.ncolor,
+        first.graphicstate.scolor,
+        first.graphicstate.ncolor,
     )
-    canvas.drawString(attrs["x0"], attrs["y0"], text=attrs["_text"])
-
-
-def print_text_line(canvas, text_line_element):
+    text = canvas.beginText(first.x0, first.y0)
+    text.textOut(first._text)
+    x0: float = first.x0
+    for char_element in char_elements[1:]:
+        # Moves are relative to the start of the previous character.
+        text.setXPos(char_element.x0 - x0)
+        text.textOut(char_element._text)
+        x0 = char_element.x0
+    canvas.drawText(text)
+
+
+def print_text_line(
+    canvas: canvas.Canvas, text_line_element: LTTextLineHorizontal
+) -> None:
     """Process a PDF LTTextLine containing a list of LTChar or LTAnno objects."""
+    run: List[LTChar] = []
+    run_format: Any = None
     for ele in text_line_element:
         if isinstance(ele, LTChar):
-            print_char(canvas, ele)
+            char_format = (
+                ele.fontname,
+                ele.size,
+                ele.graphicstate.scolor,
+                ele.graphicstate.ncolor,
+                ele.y0,
+            )
+            if char_format != run_format:
+                if run:
+                    print_char_run(canvas, run)
+                run = []
+                run_format = char_format
+            run.append(ele)
         elif isinstance(ele, LTAnno):
             None  # TODO: Not sure what to do with Annotations
         else:
             print("*******", type(ele))
             print(ele.__dict__)
+    if run:
+        print_char_run(canvas, run)
 
 
 #
@@ -89,6 +185,14 @@ def print_text_line(canvas, text_line_element):
 # This code is taken from the pdfminer.image source code to work with
 # save_image() which is revised from pdfminer.image.export_image().
 #
+_BMP_HEADER = struct.Struct("<ccIHHI")
+_BMP_INFO = struct.Struct("<IiiHHIIIIII")
+
+# Color tables for 1-bit and 8-bit images, one BGRx entry per color.
+_BW_PALETTE = struct.pack("BBBxBBBx", 0, 0, 0, 255, 255, 255)
+_GRAY_PALETTE = b"".join([struct.pack("BBBx", i, i, i) for i in range(256)])
+
+
 def align32(x):
     """Calculate the alignment of an image with the line its on."""
     return ((x + 3) // 4) * 4
@@ -97,7 +201,7 @@ def align32(x):
 class BMPWriter:
     """Determine the image type and its colorspace."""
 
-    def __init__(self, fp, bits, width, height):
+    def __init__(self, fp: BinaryIO, bits: int, width: int, height: int):
         self.fp = fp
         self.bits = bits
         self.width = width
@@ -113,11 +217,12 @@ class BMPWriter:
         self.line_size = align32((self.width * self.bits + 7) // 8)
         self.data_size = self.line_size * self.height
         header_size = 14 + 40 + num_cols * 4
-        info = struct.pack(
-            "<IiiHHIIIIII",
+        # A negative height marks the lines as stored top-down, the same
+        # order as the image data decoded from the PDF.
+        info = _BMP_INFO.pack(
             40,
             self.width,
-            self.height,
+            -self.height,
             1,
             self.bits,
             0,
@@ -128,8 +233,7 @@ class BMPWriter:
             0,
         )
         assert len(info) == 40, len(info)
-        header = struct.pack(
-            "<ccIHHI",
+        header = _BMP_HEADER.pack(
             b"B",
             b"M",
             header_size + self.data_size,
@@ -142,23 +246,56 @@ class BMPWriter:
         self.fp.write(info)
         if num_cols == 2:
             # B&W color table
-            for i in (0, 255):
-                self.fp.write(struct.pack("BBBx", i, i, i))
+            self.fp.write(_BW_PALETTE)
         elif num_cols == 256:
             # grayscale color table
-            for i in range(256):
-                self.fp.write(struct.pack("BBBx", i, i, i))
-        self.pos0 = self.fp.tell()
-        self.pos1 = self.pos0 + self.data_size
+            self.fp.write(_GRAY_PALETTE)
         return
 
-    def write_line(self, y, data):
-        """Write a line of bitmap image data to a file."""
-        self.fp.seek(self.pos1 - (y + 1) * self.line_size)
-        self.fp.write(data)
+    def write_all(self, data: bytes) -> None:
+        """Write all lines of bitmap image data to a file in one call."""
+        row_size = (self.width * self.bits + 7) // 8
+        lines = memoryview(data)[: self.height * row_size]
+        if self.bits != 24 and row_size == self.line_size:
+            # No padding or reordering is needed, so write without copying.
+            self.fp.write(lines)
+            return
+        rows = np.frombuffer(lines, dtype=np.uint8).reshape(
+            self.height, row_size
+        )
+        # Copy the rows into a buffer of padded lines, reordering pixels in
+        # the same pass, then write the buffer in one call.
+        buf = np.zeros((self.height, self.line_size), dtype=np.uint8)
+        if self.bits == 24:
+            # BMP stores pixels in BGR order.
+            shape = (self.height, self.width, 3)
+            buf[:, :row_size].reshape(shape)[:] = rows.reshape(shape)[..., ::-1]
+        else:
+            buf[:, :row_size] = rows
+        self.fp.write(buf.data)
         return
 
 
+def is_jpeg(image):
+    """Test whether an image is stored as a JPEG stream."""
+    filters = image.stream.get_filters()
+    return len(filters) == 1 and filters[0][0] in LITERALS_DCT_DECODE
+
+
+def inverted_cmyk_to_rgb(cmyk):
+    """
+    Convert an array of inverted CMYK pixels to RGB.
+
+    Gives the same result as inverting the image and converting it to RGB
+    with PIL, but in one pass over the pixels.
+    """
+    cmyk = cmyk.astype(np.uint32)
+    black = cmyk[..., 3:]
+    # Rounded (255 - c) * k / 255, computed the way PIL does.
+    tmp = (255 - cmyk[..., :3]) * black + 128
+    return (black - (((tmp >> 8) + tmp) >> 8)).astype(np.uint8)
+
+
 def save_image(image, fp):
     """
     Format raw image data and save it to the file pointer in fp.
@@ -169,7 +306,7 @@ def save_image(image, fp):
     stream = image.stream
     filters = stream.get_filters()
     (width, height) = image.srcsize
-    if len(filters) == 1 and filters[0][0] in LITERALS_DCT_DECODE:
+    if is_jpeg(image):
         ext = ".jpg"
     elif (
         image.bits == 1
@@ -183,38 +320,23 @@ def save_image(image, fp):
     if ext == ".jpg":
         raw_data = stream.get_rawdata()
         if LITERAL_DEVICE_CMYK in image.colorspace:
-            from PIL import Image, ImageChops
+            from PIL import Image
 
             ifp = BytesIO(raw_data)
             i = Image.open(ifp)
-            i = ImageChops.invert(i)
-            i = i.convert("RGB")
+            i = Image.fromarray(inverted_cmyk_to_rgb(np.asarray(i)), "RGB")
             i.save(fp, "JPEG")
         else:
             fp.write(raw_data)
     elif image.bits == 1:
         bmp = BMPWriter(fp, 1, width, height)
-        data = stream.get_data()
-        i = 0
-        width = (width + 7) // 8
-        for y in range(height):
-            bmp.write_line(y, data[i : i + width])
-            i += width
+        bmp.write_all(stream.get_data())
     elif image.bits == 8 and image.colorspace is LITERAL_DEVICE_RGB:
         bmp = BMPWriter(fp, 24, width, height)
-        data = stream.get_data()
-        i = 0
-        width = width * 3
-        for y in range(height):
-            bmp.write_line(y, data[i : i + width])
-            i += width
+        bmp.write_all(stream.get_data())
     elif image.bits == 8 and image.colorspace is LITERAL_DEVICE_GRAY:
         bmp = BMPWriter(fp, 8, width, height)
-        data = stream.get_data()
-        i = 0
-        for y in range(height):
-            bmp.write_line(y, data[i : i + width])
-            i += width
+        bmp.write_all(stream.get_data())
     # Sometimes image.colorspace is a list. Capture that case here.
     # Working this out was a bit trial-and-error, so it might have to
     # be adjusted as we find more examples.
@@ -224,19 +346,10 @@ def save_image(image, fp):
         and len(filters) == 1
     ):
         bmp = BMPWriter(fp, 24, width, height)
-        data = stream.get_data()
-        i = 0
-        width = width * 3
-        for y in range(height):
-            bmp.write_line(y, data[i : i + width])
-            i += width
+        bmp.write_all(stream.get_data())
     elif image.bits == 8 and image.colorspace is LITERAL_DEVICE_GRAY:
         bmp = BMPWriter(fp, 8, width, height)
-        data = stream.get_data()
-        i = 0
-        for y in range(height):
-            bmp.write_line(y, data[i : i + width])
-            i += width
+        bmp.write_all(stream.get_data())
 
     else:
         fp.write(stream.get_data())
@@ -245,159 +358,394 @@ def save_image(image, fp):
     return name
 
 
-def set_canvas_colors(canvas, stroke_color, fill_color):
+def reset_canvas_state() -> None:
+    """Forget the font and colors set on the previous page."""
+    _canvas_state["font"] = None
+    _canvas_state["stroke"] = None
+    _canvas_state["fill"] = None
+
+
+def set_canvas_font(
+    canvas: canvas.Canvas, pdf_fontname: str, size: float
+) -> None:
+    """Set the canvas font, skipping the call if it is already in effect."""
+    fontname = _font_cache.get(pdf_fontname)
+    if fontname is None:
+        fontname = _FONT_PREFIX_RE.sub("", pdf_fontname)
+        fontname = FONTS.get(fontname, fontname)
+        if (
+            fontname not in _STANDARD_FONTS
+            and fontname not in pdfmetrics.getRegisteredFontNames()
+        ):
+            print("unknown font:", fontname, "falling back to", DEFAULT_FONT)
+            print(
+                "But you can add this font to the FONTS in the constants file "
+                "to improve the output."
+            )
+            fontname = DEFAULT_FONT
+        _font_cache[pdf_fontname] = fontname
+
+    if _canvas_state["font"] == (fontname, size):
+        return
+
+    canvas.setFont(fontname, size)
+    _canvas_state["font"] = (fontname, size)
+
+
+def set_canvas_colors(
+    canvas: canvas.Canvas,
+    stroke_color: Any,
+    fill_color: Any,
+) -> None:
     """Set canvas stroke and fill colors."""
     # Set the stroke color
-    if stroke_color is not None:
-        if isinstance(stroke_color, float) or stroke_color in [0, 1]:
-            canvas.setStrokeGray(stroke_color)
-        else:
+    if stroke_color is not None and stroke_color != _canvas_state["stroke"]:
+        if type(stroke_color) in _COLOR_COMPONENT_TYPES:
             canvas.setStrokeColorRGB(*stroke_color)
+        else:
+            canvas.setStrokeGray(stroke_color)
+        _canvas_state["stroke"] = stroke_color
 
     # Set the fill color
-    if fill_color is not None:
-        if isinstance(fill_color, float) or fill_color in [0, 1]:
-            canvas.setFillGray(fill_color)
-        else:
+    if fill_color is not None and fill_color != _canvas_state["fill"]:
+        if type(fill_color) in _COLOR_COMPONENT_TYPES:
             canvas.setFillColorRGB(*fill_color)
+        else:
+            canvas.setFillGray(fill_color)
+        _canvas_state["fill"] = fill_color
+
+
+def _is_uniform(image, data):
+    """
+    Test whether decoded bitmap data is entirely black or entirely white.
+
+    Works directly on the bytes for 1-bit, grayscale and RGB images so the
+    common redaction box can be dropped without building a PIL image.
+    """
+    if image.bits != 1 and not (
+        image.bits == 8
+        and (
+            LITERAL_DEVICE_GRAY in image.colorspace
+            or LITERAL_DEVICE_RGB in image.colorspace
+        )
+    ):
+        return False
+    return (
+        len(data) > 0
+        and data[0] in (0, 0xFF)
+        and data.count(data[:1]) == len(data)
+    )
+
 
+def _is_uniform_extrema(extrema):
+    """Test whether PIL image extrema describe an all black or white image."""
+    if not isinstance(extrema[0], tuple):
+        # Single band images have a single (min, max) pair.
+        extrema = (extrema,)
+    values = {value for band in extrema for value in band}
+    return len(values) == 1 and values <= {0, 255}
+
+
+def decode_image(element):
+    """
+    Decode an image so that it is ready to be drawn.
 
-def print_image(canvas, element):
-    """Write an image to the canvas."""
-    attrs = element.__dict__
-    width = attrs["width"]
-    height = attrs["height"]
+    Returns an ImageReader, or None if the image should be left out of the
+    revised PDF. The canvas isn't touched, so this can run on a worker
+    thread while the rest of the page is drawn.
+    """
+    jpeg = is_jpeg(element)
     img_fp = BytesIO()
-    save_image(element, img_fp)
     try:
-        img = PIL.Image.open(img_fp, mode="r")
         # Test whether image is all black or all white
-        if sum(img.convert("L").getextrema()) in (0, 2):
-            return  # Don't include it in revised PDF.
+        if not jpeg and _is_uniform(element, element.stream.get_data()):
+            return None  # Don't include it in revised PDF.
+        save_image(element, img_fp)
+        img = PIL.Image.open(img_fp, mode="r")
+        if jpeg and _is_uniform_extrema(img.getextrema()):
+            return None  # Don't include it in revised PDF.
+        img.load()
     except Exception as err:
         print(err)
         print(element)
-        return
+        return None
+
+    return ImageReader(img)
+
+
+def prefetch_images(executor, layout):
+    """
+    Start decoding the images on a page, keyed by the id of their stream.
 
+    An image drawn several times gives several LTImage elements sharing one
+    stream. pdfminer decodes a stream lazily and not thread-safely, so each
+    stream is decoded once and the result shared by its elements.
+    """
+    images = {}
+    for element in layout:
+        if isinstance(element, LTImage):
+            subels = [element]
+        elif isinstance(element, LTFigure):
+            subels = [subel for subel in element if isinstance(subel, LTImage)]
+        else:
+            continue
+        for subel in subels:
+            key = id(subel.stream)
+            if key not in images:
+                images[key] = executor.submit(decode_image, subel)
+    return images
+
+
+def print_image(canvas, element, image):
+    """Write an image decoded by decode_image() to the canvas."""
+    if image is None:
+        return
     canvas.drawImage(
-        ImageReader(img), attrs["x0"], attrs["y0"], width=width, height=height
+        image,
+        element.x0,
+        element.y0,
+        width=element.width,
+        height=element.height,
     )
 
 
-def main(input_pdf, output_pdf):
-    """Process a PDF file."""
+def _handle_figure(canvas, element, text_lines, images):
+    """Process the images contained in a PDF LTFigure."""
+    for subel in element:
+        if isinstance(subel, LTImage):
+            print_image(canvas, subel, images[id(subel.stream)].result())
+        else:
+            # Print something out to indicate this has to be handled.
+            print("####")
+            print(type(subel), "        ", subel.__dict__)
+
+
+def _handle_image(canvas, element, text_lines, images):
+    """Process a PDF LTImage."""
+    print_image(canvas, element, images[id(element.stream)].result())
+
+
+def _handle_char(canvas, element, text_lines, images):
+    """Process a PDF LTChar that isn't part of a text line."""
+    print_char(canvas, element)
+
+
+def _handle_text_box(canvas, element, text_lines, images):
+    """Collect the text lines of a PDF LTTextBox to be printed last."""
+    # pdfminer only groups horizontal text lines into a horizontal text box.
+    text_lines.extend(element)
+
+
+def _handle_text_line(canvas, element, text_lines, images):
+    """Process a PDF LTTextLine that isn't part of a text box."""
+    print_text_line(canvas, element)
+
+
+def _handle_line(canvas, element, text_lines, images):
+    """Process a PDF LTLine."""
+    canvas.setLineWidth(element.linewidth / 10)
+    set_canvas_colors(
+        canvas, element.stroking_color, element.non_stroking_color
+    )
+    canvas.line(element.x0, element.y0, element.x1, element.y1)
+
+
+def _handle_rect(canvas, element, text_lines, images):
+    """Process a PDF LTRect, skipping redaction boxes."""
+    # Skip redaction boxes
+    if (
+        element.fill is True
+        and element.non_stroking_color in [None, 0]
+        and element.height > 2
+    ):
+        return
+
+    # This is a hack and I don't know if it will mess up other
+    # docs.  Lines used as underscores are too high up and cross
+    # through the words they underline. I make an adjustment here
+    # if it looks like a Rect is being used as an underline.
+    #    y_adjust = 0
+    #    if element.height < 1:
+    y_adjust = -3
+
+    canvas.setLineWidth(element.linewidth / 10)
+    set_canvas_colors(
+        canvas, element.stroking_color, element.non_stroking_color
+    )
+
+    canvas.rect(
+        element.x0,
+        element.y0 + y_adjust,
+        element.width,
+        element.height,
+        stroke=element.stroke,
+        fill=element.fill,
+    )
+
+
+def _handle_curve(canvas, element, text_lines, images):
+    """Process a PDF LTCurve."""
+    canvas.setLineWidth(element.linewidth / 10)
+    set_canvas_colors(
+        canvas, element.stroking_color, element.non_stroking_color
+    )
+    p = canvas.beginPath()
+    p.moveTo(element.x0, element.y0)
+    # Add the line segments to the path's code in one call, formatted the
+    # same way as PDFPathObject.lineTo().
+    p._code.extend(["%s l" % fp_str(x, y) for x, y in element.pts])
+
+    canvas.drawPath(p, fill=element.fill, stroke=element.stroke)
+
+
+# Handlers for each type of layout element found on a page. Lookups use the
+# exact element type, which pdfminer always produces for these classes.
+_HANDLERS = {
+    LTFigure: _handle_figure,
+    LTImage: _handle_image,
+    LTChar: _handle_char,
+    LTTextBoxHorizontal: _handle_text_box,
+    LTTextLineHorizontal: _handle_text_line,
+    LTLine: _handle_line,
+    LTRect: _handle_rect,
+    LTCurve: _handle_curve,
+}
+
+
+def get_page_size(page):
+    """Calculate the size of a page the way pdfminer lays it out."""
+    (x0, y0, x1, y1) = page.mediabox
+    width = abs(x1 - x0)
+    height = abs(y1 - y0)
+    if page.rotate in (90, 270):
+        return (height, width)
+    return (width, height)
+
+
+def process_page_range(
+    input_pdf,
+    page_numbers,
+    verbose=False,
+    compression=DEFAULT_COMPRESSION_LEVEL,
+):
+    """
+    Unredact a range of pages and return them as a standalone PDF.
+
+    Each call opens the input file and builds its own pdfminer objects so
+    that page ranges can be processed in separate worker processes. A dot
+    is printed for each page when verbose is set. Page content streams are
+    compressed with the given zlib level, or left uncompressed if it is 0.
+    """
     document_fp = open(input_pdf, "rb")
 
-    rsrc_mngr = PDFResourceManager()
-    la_params = LAParams()
-    device = PDFPageAggregator(rsrc_mngr, laparams=la_params)
+    # Cache fonts and other shared resources across the pages in the range.
+    rsrc_mngr = PDFResourceManager(caching=True)
+    device = PDFPageAggregator(rsrc_mngr, laparams=_LA_PARAMS)
     interpreter = PDFPageInterpreter(rsrc_mngr, device)
 
-    c = canvas.Canvas(output_pdf, pageCompression=1)
-    print("creating", output_pdf, end="", flush=True)
-
-    page_count = 0
-    for page in PDFPage.get_pages(document_fp):
-        page_count += 1
-        text_lines = []
-        print(".", end="", flush=True)
-        interpreter.process_page(page)
-        layout = device.get_result()
-        c.setPageSize((layout.__dict__["width"], layout.__dict__["height"]))
-
-        for element in layout:
-            if isinstance(element, LTFigure):
-                for subel in element:
-                    if isinstance(subel, LTImage):
-                        print_image(c, subel)
-                    else:
-                        # Print something out to indicate this has to be
-                        # handled.
-                        print("####")
-                        print(type(subel), "        ", subel.__dict__)
-
-            elif isinstance(element, LTImage):
-                print_image(c, element)
-
-            elif isinstance(element, LTChar):
-                print_char(c, element)
-
-            elif isinstance(element, LTTextBoxHorizontal):
-                for subel in element:
-                    if isinstance(subel, LTTextLineHorizontal):
-                        #                        print_text_line(c, subel)
-                        text_lines.append(subel)
-
-            elif isinstance(element, LTTextLineHorizontal):
-                print_text_line(c, element)
-
-            elif isinstance(element, LTLine):
-                attrs = element.__dict__
-                c.setLineWidth(attrs["linewidth"] / 10)
-                set_canvas_colors(
-                    c, attrs["stroking_color"], attrs["non_stroking_color"]
-                )
-                c.line(attrs["x0"], attrs["y0"], attrs["x1"], attrs["y1"])
-
-            elif isinstance(element, LTRect):
-                attrs = element.__dict__
-
-                # Skip redaction boxes
-                if (
-                    attrs["fill"] is True
-                    and attrs["non_stroking_color"] in [None, 0]
-                    and attrs["height"] > 2
-                ):
-                    continue
-
-                # This is a hack and I don't know if it will mess up other
-                # docs.  Lines used as underscores are too high up and cross
-                # through the words they underline. I make an adjustment here
-                # if it looks like a Rect is being used as an underline.
-                #                y_adjust = 0
-                #                if attrs['height'] < 1:
-                y_adjust = -3
-
-                c.setLineWidth(attrs["linewidth"] / 10)
-                set_canvas_colors(
-                    c, attrs["stroking_color"], attrs["non_stroking_color"]
-                )
-
-                c.rect(
-                    attrs["x0"],
-                    attrs["y0"] + y_adjust,
-                    attrs["width"],
-                    attrs["height"],
-                    stroke=attrs["stroke"],
-                    fill=attrs["fill"],
-                )
-
-            elif isinstance(element, LTCurve):
-                attrs = element.__dict__
-                c.setLineWidth(attrs["linewidth"] / 10)
-                set_canvas_colors(
-                    c, attrs["stroking_color"], attrs["non_stroking_color"]
-                )
-                p = c.beginPath()
-                p.moveTo(attrs["x0"], attrs["y0"])
-                for x, y in attrs["pts"]:
-                    p.lineTo(x, y)
-
-                c.drawPath(p, fill=attrs["fill"], stroke=attrs["stroke"])
-
-            else:
-                # Print out attribute information to indicate that this has
-                # to be handled.
-                print(type(element), element.__dict__)
-
-        # Print text lines last so they aren't obscured by boxes, etc.
-        for text_line in text_lines:
-            print_text_line(c, text_line)
-
-        c.showPage()
-
-    print("saving", end="", flush=True)
-    c.save()
-    print()
-
+    output_fp = BytesIO()
+    c = canvas.Canvas(output_fp, pageCompression=1 if compression else 0)
+    reset_canvas_state()
+
+    get_handler = _HANDLERS.get
+
+    with ThreadPoolExecutor(max_workers=2) as image_executor:
+        for page in PDFPage.get_pages(
+            document_fp, pagenos=set(page_numbers), caching=True
+        ):
+            text_lines = []
+            if verbose:
+                print(".", end="", flush=True)
+            if not page.contents:
+                # Nothing to lay out, so add a blank page of the same size.
+                c.setPageSize(get_page_size(page))
+                c.showPage()
+                reset_canvas_state()
+                continue
+            interpreter.process_page(page)
+            layout = device.get_result()
+            # Decode images in the background while the page is drawn. They
+            # are still drawn in page order on this thread.
+            images = prefetch_images(image_executor, layout)
+            c.setPageSize((layout.width, layout.height))
+
+            for element in layout:
+                handler = get_handler(type(element))
+                if handler is not None:
+                    handler(c, element, text_lines, images)
+                else:
+                    # Print out attribute information to indicate that this has
+                    # to be handled.
+                    print(type(element), element.__dict__)
+
+            # Print text lines last so they aren't obscured by boxes, etc.
+            for text_line in text_lines:
+                print_text_line(c, text_line)
+
+            c.showPage()
+            reset_canvas_state()
+
+    # Page streams are compressed when the canvas is saved, so the filter
+    # is only swapped in for the save and ReportLab's is always put back.
+    default_filter = pdfdoc.PDFZCompress
+    if compression:
+        pdfdoc.PDFZCompress = _LeveledZCompress(compression)
+    try:
+        c.save()
+    finally:
+        pdfdoc.PDFZCompress = default_filter
     document_fp.close()
+
+    return output_fp.getvalue()
+
+
+def split_page_range(page_count, chunk_count):
+    """Split the page numbers of a document into contiguous chunks."""
+    chunk_size = max(1, -(-page_count // chunk_count))
+    return [
+        range(start, min(start + chunk_size, page_count))
+        for start in range(0, page_count, chunk_size)
+    ]
+
+
+def main(
+    input_pdf,
+    output_pdf,
+    verbose=False,
+    compression=DEFAULT_COMPRESSION_LEVEL,
+):
+    """
+    Process a PDF file, printing progress if verbose is set.
+
+    compression is the zlib level used for page content streams, from 0
+    (no compression) to 9. Lower levels are faster but give larger files.
+    """
+    page_count = len(PdfReader(input_pdf).pages)
+    chunks = split_page_range(page_count, cpu_count())
+
+    if verbose:
+        print("creating", output_pdf, end="", flush=True)
+
+    process = partial(
+        process_page_range,
+        input_pdf,
+        verbose=verbose,
+        compression=compression,
+    )
+    writer = PdfWriter()
+    if len(chunks) > 1:
+        with Pool(len(chunks)) as pool:
+            # imap keeps the partial PDFs in page order while still letting
+            # the workers run ahead of the merge.
+            for partial_pdf in pool.imap(process, chunks):
+                writer.append(BytesIO(partial_pdf))
+    else:
+        # Not worth starting a worker process for a single page range.
+        for partial_pdf in map(process, chunks):
+            writer.append(BytesIO(partial_pdf))
+
+    if verbose:
+        print("saving", end="", flush=True)
+    writer.write(output_pdf)
+    if verbose:
+        print()
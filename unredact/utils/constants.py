@@ -2,6 +2,9 @@
 
 DEFAULT_FONT = "Times-Roman"
 
+# zlib level used to compress page content streams. 6 is zlib's own default.
+DEFAULT_COMPRESSION_LEVEL = 6
+
 FONTS = {
     "TimesNewRomanPSMT": "Times-Roman",
     "TimesNewRomanPS-ItalicMT": "Times-Italic",